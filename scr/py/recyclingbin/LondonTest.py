@@ -1,50 +1,54 @@
 import os
+import numpy as np
+import pandas as pd
 import osmnx as ox
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+from london_graph import load_or_fetch_london
 
 # -------------------------------
-# LTS 估算函数
+# LTS 估算函数（按列向量化，输入为等长的数组/Series）
+DEFAULT_SPEED = {
+    "residential": 25,
+    "tertiary": 30,
+    "secondary": 35,
+    "primary": 40,
+    "trunk": 45
+}
+DEFAULT_LANES = {
+    "residential": 2,
+    "tertiary": 2,
+    "secondary": 3,
+    "primary": 4,
+    "trunk": 4
+}
+
 def estimate_lts_conveyal(functional_class, has_bike_lane, speed_limit, lane_count):
-    if speed_limit is None:
-        speed_limit = {
-            "residential": 25,
-            "tertiary": 30,
-            "secondary": 35,
-            "primary": 40,
-            "trunk": 45
-        }.get(functional_class, 35)
-    if lane_count is None:
-        lane_count = {
-            "residential": 2,
-            "tertiary": 2,
-            "secondary": 3,
-            "primary": 4,
-            "trunk": 4
-        }.get(functional_class, 3)
-    if has_bike_lane is None:
-        has_bike_lane = False
+    fc = pd.Series(functional_class).astype(str).to_numpy()
+    bl = pd.Series(has_bike_lane).fillna(False).to_numpy(bool)
+    sp = pd.to_numeric(pd.Series(speed_limit), errors="coerce").to_numpy(float, na_value=np.nan)
+    lc = pd.to_numeric(pd.Series(lane_count), errors="coerce").to_numpy(float, na_value=np.nan)
 
-    if functional_class in ["residential", "living_street"] and has_bike_lane and speed_limit <= 25:
-        return 1
-    elif has_bike_lane and speed_limit <= 30 and lane_count <= 2:
-        return 2
-    elif not has_bike_lane and functional_class in ["residential", "tertiary"] and speed_limit <= 30:
-        return 3
-    elif lane_count >= 4 or speed_limit >= 45:
-        return 4
-    elif functional_class in ["primary", "secondary", "trunk"] and not has_bike_lane:
-        return 4
-    elif has_bike_lane and speed_limit > 35:
-        return 3
-    else:
-        return 2
+    # 缺失值按道路等级补默认值
+    sp = np.where(np.isnan(sp), pd.Series(fc).map(DEFAULT_SPEED).fillna(35).to_numpy(float), sp)
+    lc = np.where(np.isnan(lc), pd.Series(fc).map(DEFAULT_LANES).fillna(3).to_numpy(float), lc)
+
+    # 规则按优先级排列，np.select 取第一个满足的
+    conditions = [
+        np.isin(fc, ["residential", "living_street"]) & bl & (sp <= 25),
+        bl & (sp <= 30) & (lc <= 2),
+        ~bl & np.isin(fc, ["residential", "tertiary"]) & (sp <= 30),
+        (lc >= 4) | (sp >= 45),
+        np.isin(fc, ["primary", "secondary", "trunk"]) & ~bl,
+        bl & (sp > 35),
+    ]
+    choices = [1, 2, 3, 4, 4, 3]
+    return np.select(conditions, choices, default=2).astype(np.int8)
 
 # -------------------------------
-# 下载伦敦边界
+# 伦敦边界
 place_name = "London, England, United Kingdom"
-gdf = ox.geocode_to_gdf(place_name)
 
 # 使用过滤器：抓取适合骑行的所有道路（含 cycleway 等）
 custom_filter = (
@@ -55,36 +59,30 @@ custom_filter = (
 )
 
 print("📥 正在下载伦敦骑行道路数据...")
-graph = ox.graph_from_polygon(gdf.geometry[0], custom_filter=custom_filter)
+graph = load_or_fetch_london(custom_filter, place_name=place_name)
 edges = ox.graph_to_gdfs(graph, nodes=False)
 
 # -------------------------------
 # 数据预处理
-def to_bool(val):
-    if val in [True, "yes", "Yes", "YES", "lane", "track"]:
-        return True
-    return False
+BIKE_LANE_VALUES = {"true", "yes", "lane", "track"}
 
 edges["functional_class"] = edges["highway"].astype(str)
-edges["has_bike_lane"] = edges["cycleway"].astype(str).apply(lambda x: to_bool(x) if x != "nan" else False) if "cycleway" in edges.columns else False
-edges["speed_limit"] = edges["maxspeed"].apply(
-    lambda x: float(x.split()[0]) if isinstance(x, str) and x.split()[0].isdigit() else None
-)
-edges["lane_count"] = edges["lanes"].apply(
-    lambda x: int(x) if isinstance(x, str) and x.isdigit() else None
+edges["has_bike_lane"] = edges["cycleway"].astype(str).str.lower().isin(BIKE_LANE_VALUES) if "cycleway" in edges.columns else False
+edges["speed_limit"] = pd.to_numeric(
+    edges["maxspeed"].astype(str).str.extract(r"(\d+)", expand=False), errors="coerce"
 )
+edges["lane_count"] = pd.to_numeric(
+    edges["lanes"].astype(str).str.extract(r"(\d+)", expand=False), errors="coerce"
+).astype("Int64")
 
 # -------------------------------
 # LTS 估算
 print("🧠 正在估算 LTS 等级...")
-edges["lts"] = edges.apply(
-    lambda row: estimate_lts_conveyal(
-        row["functional_class"],
-        row["has_bike_lane"],
-        row["speed_limit"],
-        row["lane_count"]
-    ),
-    axis=1
+edges["lts"] = estimate_lts_conveyal(
+    edges["functional_class"],
+    edges["has_bike_lane"],
+    edges["speed_limit"],
+    edges["lane_count"]
 )
 
 # -------------------------------
@@ -92,7 +90,7 @@ edges["lts"] = edges.apply(
 output_dir = "../data"
 os.makedirs(output_dir, exist_ok=True)
 output_path = os.path.join(output_dir, "london_highway_lts.geojson")
-edges.to_file(output_path, driver="GeoJSON")
+edges.to_file(output_path, driver="GeoJSON", engine="pyogrio")
 print(f"✅ LTS 数据导出成功：{output_path}")
 
 # -------------------------------
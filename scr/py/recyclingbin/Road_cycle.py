@@ -1,11 +1,9 @@
+import numpy as np
 import osmnx as ox
 import geopandas as gpd
 import networkx as nx
 import re
-
-# 设置区域
-place_name = "Greater London, United Kingdom"
-gdf = ox.geocode_to_gdf(place_name)
+from london_graph import load_or_fetch_london
 
 # 设置自定义过滤器：抓取所有包含骑行相关标签的道路
 custom_filter = (
@@ -15,14 +13,19 @@ custom_filter = (
 )
 
 print("📥 正在抓取含骑行功能的路网...")
-G = ox.graph_from_polygon(gdf.geometry[0], custom_filter=custom_filter, simplify=True)
+G = load_or_fetch_london(custom_filter)
 
 # 取最大连通分量
 if G.is_directed():
     comps = nx.weakly_connected_components(G)
 else:
     comps = nx.connected_components(G)
-G = G.subgraph(max(comps, key=len)).copy().to_undirected()
+largest_cc = max(comps, key=len)
+# 原图上就地删掉其余分量的节点，再一次性转无向
+# 用 to_undirected() 而不是 nx.MultiGraph(G)：后者遇到 (u, v) 已有时会跳过 (v, u)，
+# 只存在于反向的平行边（单行道与双向道并行）会被丢掉
+G.remove_nodes_from([n for n in G.nodes if n not in largest_cc])
+G = G.to_undirected()
 
 # 删除死胡同
 deadends = [n for n in G.nodes if G.degree[n] == 1]
@@ -58,24 +61,18 @@ for field in [tag.replace(":", "_") for tag in keep_tags]:
         edges[field] = edges[field].apply(clean_field)
 
 # 添加物理隔断字段判断
-def has_physical_barrier(row):
-    values = [
-        row.get('cycleway'),
-        row.get('cycleway_left'),
-        row.get('cycleway_right'),
-        row.get('cycleway_both'),
-        row.get('cycleway_segregated'),
-    ]
-    for val in values:
-        if val:
-            val = str(val).lower()
-            if val in ['track', 'separate', 'yes']:
-                return True
-    return False
+BARRIER_VALUES = {'track', 'separate', 'yes'}
+
+def has_physical_barrier(df):
+    m = np.zeros(len(df), dtype=bool)
+    for col in ['cycleway', 'cycleway_left', 'cycleway_right', 'cycleway_both', 'cycleway_segregated']:
+        if col in df.columns:
+            m |= df[col].astype(str).str.lower().isin(BARRIER_VALUES).to_numpy()
+    return m
 
-edges['has_physical_barrier'] = edges.apply(has_physical_barrier, axis=1)
+edges['has_physical_barrier'] = has_physical_barrier(edges)
 
 # 导出为 GPKG
 output_path = "bike.gpkg"
-edges.to_file(output_path, layer="bike_edges", driver="GPKG")
+edges.to_file(output_path, layer="bike_edges", driver="GPKG", engine="pyogrio")
 print(f"导出完成：{output_path}")
@@ -1,10 +1,7 @@
 import osmnx as ox
 import geopandas as gpd
 import networkx as nx
-
-# 获取 Greater London 边界
-place_name = "Greater London, United Kingdom"
-gdf = ox.geocode_to_gdf(place_name)
+from london_graph import load_or_fetch_london
 
 # 自定义过滤器：允许骑行的道路
 custom_filter = (
@@ -17,7 +14,7 @@ custom_filter = (
 
 # 下载骑行网络
 print("正在抓取骑行网络数据（超级慢）...")
-graph = ox.graph_from_polygon(gdf.geometry[0], custom_filter=custom_filter, simplify=True)
+graph = load_or_fetch_london(custom_filter)
 G = graph
 
 # 清洗图结构：最大连通分量 + 转无向图
@@ -26,7 +23,11 @@ if G.is_directed():
 else:
     comps = nx.connected_components(G)
 largest_cc = max(comps, key=len)
-G = G.subgraph(largest_cc).copy().to_undirected()
+# 原图上就地删掉其余分量的节点，再一次性转无向
+# 用 to_undirected() 而不是 nx.MultiGraph(G)：后者遇到 (u, v) 已有时会跳过 (v, u)，
+# 只存在于反向的平行边（单行道与双向道并行）会被丢掉
+G.remove_nodes_from([n for n in G.nodes if n not in largest_cc])
+G = G.to_undirected()
 
 # === 5. 删除死胡同（度为1节点）===
 deadends = [n for n in G.nodes if G.degree[n] == 1]
@@ -48,7 +49,7 @@ nodes, edges = ox.graph_to_gdfs(G)
 # 8. 导出图结构和边文件（只保留一个gpkg）
 # ox.save_graphml(G, "london_bike_cleaned.graphml")
 # edges.to_file("london_edges_FIXED.geojson", driver="GeoJSON") 
-edges.to_file("london_edges_FIXED.gpkg", layer='edges', driver="GPKG")
+edges.to_file("london_edges_FIXED.gpkg", layer='edges', driver="GPKG", engine="pyogrio")
 
 
 print("导出完成")
\ No newline at end of file
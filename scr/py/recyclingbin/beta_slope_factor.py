@@ -1,18 +1,34 @@
+import numpy as np
+from osgeo import gdal
 from qgis.core import (
-    QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
     QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSink,
     QgsVectorLayer,
     QgsRasterLayer,
     QgsWkbTypes,
     QgsProject,
-    QgsPointXY,
     QgsField,
-    edit,
 )
 from PyQt5.QtCore import QVariant
 
-import statistics
+try:
+    from pyproj import Transformer
+    from pyproj.exceptions import CRSError
+except ImportError:  # QGIS 自带的 Python 不一定装了 pyproj
+    Transformer = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # 没有 numba 时用纯 numpy 取值
+    njit = None
+
+
+# 加密结果每攒够这么多要素就写入内存图层一次
+DENSIFY_FLUSH_SIZE = 10000
+# 采样窗口超过这么多像元（float32 约 400 MB）时改为按栅格分块读取
+RASTER_WINDOW_MAX_PIXELS = 100_000_000
 
 
 def densify_layer_by_distance(src_layer, interval_m):
@@ -28,7 +44,8 @@ def densify_layer_by_distance(src_layer, interval_m):
     prov.addAttributes(src_layer.fields())
     mem.updateFields()
 
-    feats = []
+    # 边读边写：每 DENSIFY_FLUSH_SIZE 个要素写入 provider 一次，Python 侧只留一批
+    batch = []
     for f in src_layer.getFeatures():
         g = f.geometry()
         if not g or g.isEmpty():
@@ -40,114 +57,267 @@ def densify_layer_by_distance(src_layer, interval_m):
         nf = QgsFeature(mem.fields())
         nf.setAttributes(f.attributes())
         nf.setGeometry(dg)
-        feats.append(nf)
-
-    if feats:
-        prov.addFeatures(feats)
-        mem.updateExtents()
+        batch.append(nf)
+        if len(batch) >= DENSIFY_FLUSH_SIZE:
+            prov.addFeatures(batch, QgsFeatureSink.FastInsert)
+            batch.clear()
+    if batch:
+        prov.addFeatures(batch, QgsFeatureSink.FastInsert)
+    mem.updateExtents()
     return mem
 
 
-from qgis.core import QgsProject, QgsCoordinateTransform, QgsPointXY
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _gather_window(arr, xs, ys, inv, xoff, yoff, nodata, out):
+        """
+        (x, y) -> 行列号、窗口越界判断、取值、nodata 置 NaN 合并成一个循环，只扫一遍顶点。
+        窗口外的点不写 out；不开 fastmath，否则 NaN 比较不可靠。
+        """
+        H, W = arr.shape
+        for i in prange(xs.shape[0]):
+            c = np.floor(inv[0] + inv[1] * xs[i] + inv[2] * ys[i]) - xoff
+            r = np.floor(inv[3] + inv[4] * xs[i] + inv[5] * ys[i]) - yoff
+            if 0 <= r < H and 0 <= c < W:
+                v = arr[int(r), int(c)]
+                out[i] = np.nan if v == nodata else v
+else:
+    _gather_window = None
 
-def sample_raster_values_at_vertices(line_layer, raster_layer):
+
+def _gather_by_block(band, rows, cols):
     """
-    沿线每个顶点采样坡度值，返回 {feature_id: [vals]}。
-    使用 line_layer 的 CRS -> raster_layer 的 CRS 做坐标变换。
+    把顶点按栅格分块（GetBlockSize）分桶，一次读一个块并取值，适合放不进内存的大栅格。
+    rows/cols 须都落在栅格内。
     """
-    provider   = raster_layer.dataProvider()
-    raster_crs = raster_layer.crs()
-    src_crs    = line_layer.crs()
+    bx, by = band.GetBlockSize()
+    nbx = (band.XSize + bx - 1) // bx
+    key = (rows // by) * nbx + cols // bx
 
-    # 用项目的 transform context
-    xform = QgsCoordinateTransform(src_crs, raster_crs, QgsProject.instance()) if src_crs != raster_crs else None
+    out = np.empty(rows.shape, dtype=np.float64)
+    order = np.argsort(key, kind="stable")
+    blocks, starts = np.unique(key[order], return_index=True)
+    for b, idx in zip(blocks, np.split(order, starts[1:])):
+        x0, y0 = int(b % nbx) * bx, int(b // nbx) * by
+        arr = band.ReadAsArray(x0, y0, min(bx, band.XSize - x0), min(by, band.YSize - y0))
+        if arr is None:
+            raise RuntimeError(f"读取坡度栅格分块失败：({x0}, {y0})")
+        out[idx] = arr[rows[idx] - y0, cols[idx] - x0]
+    return out
 
-    # nodata（可选）
-    try:
-        nodata = provider.sourceNoDataValue(1)
-    except Exception:
-        nodata = None
 
-    values_dict = {}
-    for feat in line_layer.getFeatures():
-        fid  = feat.id()
-        geom = feat.geometry()
-        vals = []
-        if not geom or geom.isEmpty():
-            values_dict[fid] = vals
-            continue
+def _read_raster_at(raster_path, xs, ys):
+    """
+    用 GDAL 读栅格第 1 波段，按仿射变换把 (x, y) 换成行列号后批量取值。
+    只读全部顶点所在的像元窗口（行列外包框），道路只覆盖一小块时不必整幅读入。
+    xs/ys 须已在栅格 CRS 下；栅格外或 nodata 的点返回 NaN。
+    """
+    ds = gdal.Open(raster_path)
+    if ds is None:
+        raise RuntimeError(f"GDAL 无法打开坡度栅格：{raster_path}")
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    inv = gdal.InvGeoTransform(ds.GetGeoTransform())
+
+    vals = np.full(xs.shape, np.nan, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        fcols = np.floor(inv[0] + inv[1] * xs + inv[2] * ys)
+        frows = np.floor(inv[3] + inv[4] * xs + inv[5] * ys)
+        inside = (frows >= 0) & (frows < ds.RasterYSize) & (fcols >= 0) & (fcols < ds.RasterXSize)
+    if not inside.any():
+        return vals
+    rows = frows[inside].astype(np.int64)
+    cols = fcols[inside].astype(np.int64)
+
+    # 像元窗口：落在栅格内的顶点的最小 / 最大行列
+    xoff, yoff = int(cols.min()), int(rows.min())
+    xsize, ysize = int(cols.max()) - xoff + 1, int(rows.max()) - yoff + 1
+    if xsize * ysize <= RASTER_WINDOW_MAX_PIXELS:
+        arr = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        if arr is None:
+            raise RuntimeError(f"读取坡度栅格窗口失败：{raster_path}")
+        if _gather_window is not None:
+            # nodata 为空时传 NaN：v == NaN 恒为假，不会误伤有效值
+            _gather_window(arr, xs, ys, np.asarray(inv, dtype=np.float64), xoff, yoff,
+                           np.nan if nodata is None else float(nodata), vals)
+            return vals
+        vals[inside] = arr[rows - yoff, cols - xoff]
+    else:
+        # 窗口仍然太大：按栅格自身的分块逐块读取，内存只占一个块
+        vals[inside] = _gather_by_block(band, rows, cols)
+    if nodata is not None:
+        vals[vals == nodata] = np.nan
+    return vals
 
-        for v in geom.vertices():
-            pt = QgsPointXY(v)
-            if xform:
-                try:
-                    pt = xform.transform(pt)
-                except Exception:
-                    continue
-            try:
-                val, ok = provider.sample(pt, 1)   # band=1
-            except Exception:
-                val, ok = (None, False)
-
-            if not ok:
-                continue
-            if nodata is not None and val == nodata:
-                continue
-            try:
-                vals.append(float(val))
-            except (TypeError, ValueError):
-                pass
 
-        values_dict[fid] = vals
+# (源 CRS, 栅格 CRS) -> 变换对象，同一会话里反复调用时不必重新查找 datum 变换
+_XFORM_CACHE = {}
 
-    return values_dict
 
+def _crs_def(crs):
+    """pyproj 能识别的 CRS 定义：EPSG 用 authid，其余（如自定义的 USER:100000）用 WKT。"""
+    authid = crs.authid()
+    return authid if authid.startswith("EPSG:") else crs.toWkt()
+
+
+def _get_transform(src_crs, dst_crs):
     """
-    沿线每个顶点采样坡度值，返回 {feature_id: [vals]} 字典
+    按 CRS 对取缓存的变换：有 pyproj 且能解析两个 CRS 时为 Transformer，
+    否则为 QgsCoordinateTransform。
     """
-    if isinstance(target_crs_epsg, str):
-        target_crs_epsg = target_crs_epsg.replace("EPSG:", "").strip()
-    target_crs = QgsCoordinateReferenceSystem.fromEpsgId(int(target_crs_epsg))
+    src_def, dst_def = _crs_def(src_crs), _crs_def(dst_crs)
+    key = (src_def, dst_def)
+    t = _XFORM_CACHE.get(key)
+    if t is None:
+        if Transformer is not None:
+            try:
+                t = Transformer.from_crs(src_def, dst_def, always_xy=True)
+            except CRSError:
+                t = None
+        if t is None:
+            t = QgsCoordinateTransform(src_crs, dst_crs, QgsProject.instance())
+        _XFORM_CACHE[key] = t
+    return t
+
 
-    raster_provider = raster_layer.dataProvider()
+def sample_raster_values_flat(line_layer, raster_layer, interval_m=None):
+    """
+    沿线每个顶点采样坡度值，按"扁平数组 + 偏移"返回 (fids, values, offsets)：
+    fids 为 int64[n]，values 为 float32[N]（已去掉栅格外 / nodata 的点），
+    第 i 个要素的采样值是 values[offsets[i]:offsets[i + 1]]。
+    使用 line_layer 的 CRS -> raster_layer 的 CRS 做坐标变换。
+    先收集全部顶点坐标，再对栅格做一次批量取值，避免逐点 provider.sample()。
+    给定 interval_m 时逐要素就地加密后再取顶点，加密几何用完即丢，不生成中间图层。
+    """
     raster_crs = raster_layer.crs()
-    transform = QgsCoordinateTransform(target_crs, raster_crs, raster_layer.dataProvider().transformContext())
+    src_crs    = line_layer.crs()
 
-    values_dict = {}
-    for feat in line_layer.getFeatures():
-        fid = feat.id()
+    # CRS 不同才需要变换：优先 pyproj 对全部顶点一次性批量变换；
+    # 没有 pyproj 或 pyproj 解析不了 CRS 时退回逐点 QgsCoordinateTransform（项目的 transform context）
+    transformer = xform = None
+    if src_crs != raster_crs:
+        t = _get_transform(src_crs, raster_crs)
+        if isinstance(t, QgsCoordinateTransform):
+            xform = t
+        else:
+            transformer = t
+
+    # 只需要几何，不取属性
+    fids, counts, xs, ys = [], [], [], []
+    for feat in line_layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        fids.append(feat.id())
         geom = feat.geometry()
-        vals = []
-        for vertex in geom.vertices():
-            pt = transform.transform(vertex)
-            ident = raster_provider.sample(pt, 1)  # band=1
-            if ident[1]:
+        pts = []
+        if geom and not geom.isEmpty():
+            if interval_m:
                 try:
-                    val = float(ident[0])
-                    vals.append(val)
-                except (ValueError, TypeError):
+                    geom = geom.densifyByDistance(float(interval_m))
+                except Exception:
                     pass
-        values_dict[fid] = vals
-    return values_dict
+            # 一次性取出全部顶点（QgsPointXY 列表），避免 vertices() 逐点迭代
+            lines = geom.asMultiPolyline() if geom.isMultipart() else [geom.asPolyline()]
+            pts = [p for line in lines for p in line]
+            if xform:
+                tpts = []
+                for p in pts:
+                    try:
+                        tpts.append(xform.transform(p))
+                    except Exception:
+                        continue
+                pts = tpts
+        xs.extend(p.x() for p in pts)
+        ys.extend(p.y() for p in pts)
+        counts.append(len(pts))
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if transformer is not None:
+        # 变换失败的点为 inf，取值时落在栅格外，自然被丢掉
+        xs, ys = transformer.transform(xs, ys)
+
+    vals = _read_raster_at(raster_layer.source(), xs, ys)
+
+    # 丢掉栅格外 / nodata 的点，按剩下的点数重算每个要素的偏移
+    valid = ~np.isnan(vals)
+    seg = np.repeat(np.arange(len(fids)), counts)
+    offsets = np.zeros(len(fids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(seg[valid], minlength=len(fids)), out=offsets[1:])
+
+    return np.asarray(fids, dtype=np.int64), vals[valid].astype(np.float32), offsets
+
+
+def sample_raster_values_at_vertices(line_layer, raster_layer, interval_m=None):
+    """
+    沿线每个顶点采样坡度值，返回 {feature_id: [vals]}（sample_raster_values_flat 的字典形式）。
+    """
+    fids, values, offsets = sample_raster_values_flat(line_layer, raster_layer, interval_m)
+    return {int(fid): values[a:b].tolist() for fid, a, b in zip(fids, offsets[:-1], offsets[1:])}
 
 
 def calc_stat(values, choice="q3"):
     """
     根据 choice 计算统计值，choice ∈ {'q3', 'max', 'mean'}
+    values 可以是 list 或 ndarray；q3 为线性插值的 75% 分位数
     """
-    if not values:
+    if len(values) == 0:
         return None
-    if choice == "max":
-        return max(values)
-    elif choice == "mean":
-        return statistics.mean(values)
+    a = np.asarray(values, dtype=np.float64)
+    if choice == "mean":
+        return float(a.mean())
     elif choice == "q3":
-        try:
-            return statistics.quantiles(values, n=4)[2]
-        except Exception:
-            return max(values)
+        return float(np.quantile(a, 0.75))
     else:
-        return max(values)
+        return float(a.max())
+
+
+def segment_stat(values, offsets, choice="q3"):
+    """
+    对扁平数组按 offsets 分段统计，返回 float64[n]，没有采样值的段为 NaN。
+    'mean' / 'max' 用 reduceat，'q3' 先段内排序再线性插值（与 np.quantile 一致）。
+    """
+    counts = np.diff(offsets)
+    out = np.full(counts.shape, np.nan, dtype=np.float64)
+    nonempty = counts > 0
+    if not nonempty.any():
+        return out
+    a = values.astype(np.float64)
+    starts = offsets[:-1][nonempty]
+
+    # 只用非空段的起点：相邻起点之间正好是一段，空段长度为 0 不影响
+    if choice == "mean":
+        out[nonempty] = np.add.reduceat(a, starts) / counts[nonempty]
+    elif choice == "q3":
+        seg = np.repeat(np.arange(len(counts)), counts)
+        a = a[np.lexsort((a, seg))]
+        pos = starts + 0.75 * (counts[nonempty] - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        out[nonempty] = a[lo] + (a[hi] - a[lo]) * (pos - lo)
+    else:
+        out[nonempty] = np.maximum.reduceat(a, starts)
+    return out
+
+
+def compute_slope_factors(roads_layer, slope_raster, sample_interval_m=20, slope_unit="degree", stat_choice="q3"):
+    """
+    单遍计算每条道路的代表坡度与因子，返回 {fid: (proc_slope, fac_3)}，均保留两位小数。
+    加密、取顶点、采样都在同一次要素遍历里完成（见 sample_raster_values_flat），
+    fid 直接对应 roads_layer；没有采样值的按 0 坡度（因子 1.0）处理。
+    """
+    fids, values, offsets = sample_raster_values_flat(roads_layer, slope_raster, sample_interval_m)
+
+    # 每个要素的代表坡度（没有采样值的记 NaN）
+    rep = segment_stat(values, offsets, stat_choice)
+
+    # 如果是角度单位，先转百分比
+    pct = np.tan(np.deg2rad(rep)) * 100.0 if slope_unit == "degree" else rep
+    pct = np.where(np.isnan(pct), 0.0, pct)
+    fac = slope_to_factor(pct)
+
+    # 整列一次保留两位小数，转 Python float 只留在交给 QGIS 的那一步
+    pct = np.round(pct, 2)
+    fac = np.round(fac, 2)
+    return {int(fid): (float(slope_val), float(fac_3)) for fid, slope_val, fac_3 in zip(fids, pct, fac)}
 
 
 def apply_slope_factor(
@@ -169,12 +339,8 @@ def apply_slope_factor(
         if not slope_raster.isValid():
             raise RuntimeError("坡度栅格无效")
 
-    # 加密几何
-    densified = densify_layer_by_distance(roads_layer, sample_interval_m)
-
-    # 采样
-    values_dict = sample_raster_values_at_vertices(densified, slope_raster)
-
+    # 加密 + 采样 + 统计一遍完成，不生成加密后的中间图层
+    results = compute_slope_factors(roads_layer, slope_raster, sample_interval_m, slope_unit, stat_choice)
 
     # 确保字段存在
     prov = roads_layer.dataProvider()
@@ -185,40 +351,27 @@ def apply_slope_factor(
         prov.addAttributes([QgsField("fac_3", QVariant.Double)])
     roads_layer.updateFields()
 
-    # 回写
-    with edit(roads_layer):
-        for feat in roads_layer.getFeatures():
-            fid = feat.id()
-            vals = values_dict.get(fid, [])
-            slope_val = calc_stat(vals, stat_choice)
-            if slope_val is None:
-                slope_val = 0.0
-                fac_3 = 1.0
-            else:
-                # 如果是角度单位，先转百分比
-                if slope_unit == "degree":
-                    import math
-                    slope_val = math.tan(math.radians(slope_val)) * 100.0
-                fac_3 = slope_to_factor(slope_val)
-            roads_layer.changeAttributeValue(fid, roads_layer.fields().indexFromName("proc_slope"), round(slope_val, 2))
-            roads_layer.changeAttributeValue(fid, roads_layer.fields().indexFromName("fac_3"), round(fac_3, 2))
+    proc_idx = roads_layer.fields().indexFromName("proc_slope")
+    fac_idx = roads_layer.fields().indexFromName("fac_3")
+
+    # 回写：一次性交给 provider，绕过编辑缓冲区 / 撤销栈
+    attr_map = {
+        fid: {proc_idx: slope_val, fac_idx: fac_3}
+        for fid, (slope_val, fac_3) in results.items()
+    }
+    if not prov.changeAttributeValues(attr_map):
+        raise RuntimeError("写回 proc_slope / fac_3 失败")
 
     return roads_layer
 
 
+# 坡度百分比分段上界（含），超过最后一个上界取最后一个因子
+SLOPE_BINS = np.array([2, 4, 6, 8, 10], dtype=np.float64)
+SLOPE_FACTORS = np.array([1.0, 0.9, 0.75, 0.6, 0.45, 0.3])
+
+
 def slope_to_factor(slope_percent):
     """
-    将坡度百分比映射为因子（示例规则，可按需调整）
-    """
-    if slope_percent <= 2:
-        return 1.0
-    elif slope_percent <= 4:
-        return 0.9
-    elif slope_percent <= 6:
-        return 0.75
-    elif slope_percent <= 8:
-        return 0.6
-    elif slope_percent <= 10:
-        return 0.45
-    else:
-        return 0.3
+    将坡度百分比映射为因子（示例规则，可按需调整），标量或数组均可
+    """
+    return SLOPE_FACTORS[np.searchsorted(SLOPE_BINS, slope_percent, side="left")]
@@ -8,11 +8,12 @@ Usage:
 import os
 import glob
 import argparse
+from functools import partial
 import re
-import math
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, LineString, MultiLineString
+import shapely
 from shapely.ops import split
 from pyproj import CRS
 
@@ -56,66 +57,63 @@ def parse_args():
     return parser.parse_args()
 
 
-def extract_numeric(val):
-    if val is None:
-        return None
-    m = re.search(r"\d+", str(val))
-    return float(m.group()) if m else None
+_NUM = re.compile(r"(\d+)")
+
+
+def extract_numeric(s):
+    # first run of digits in each value, as float (NaN where there is none)
+    return pd.to_numeric(s.astype(str).str.extract(_NUM, expand=False), errors="coerce").astype(float)
 
 
 def remove_deadends(gdf):
-    endpoints = []
-    for geom in gdf.geometry:
-        if isinstance(geom, LineString):
-            coords = list(geom.coords)
-            endpoints.extend([(coords[0][0], coords[0][1]), (coords[-1][0], coords[-1][1])])
-    counts = pd.Series(endpoints).value_counts()
-    dead_coords = set(counts[counts == 1].index)
-    def is_dead(geom):
-        if not isinstance(geom, LineString): return False
-        start = (geom.coords[0][0], geom.coords[0][1])
-        end = (geom.coords[-1][0], geom.coords[-1][1])
-        return start in dead_coords or end in dead_coords
-    return gdf[~gdf.geometry.apply(is_dead)].copy()
+    geoms = np.asarray(gdf.geometry.array)
+    is_line = shapely.get_type_id(geoms) == shapely.GeometryType.LINESTRING
+    lines = geoms[is_line]
+    coords = shapely.get_coordinates(lines)
+    n_coords = shapely.get_num_coordinates(lines)
+    ends = np.cumsum(n_coords)
+    starts = ends - n_coords
+    # rows [0, n) are start points, [n, 2n) end points; inv maps each row to its unique point
+    ep = np.vstack([coords[starts], coords[ends - 1]])
+    _, inv, counts = np.unique(ep, axis=0, return_inverse=True, return_counts=True)
+    inv = inv.reshape(-1)
+    n = len(lines)
+    dead = np.zeros(len(gdf), dtype=bool)
+    dead[is_line] = (counts[inv[:n]] == 1) | (counts[inv[n:]] == 1)
+    return gdf[~dead].copy()
 
 
 def generate_points_along(gdf, dist):
-    pts, ids = [], []
-    for idx, row in gdf.iterrows():
-        line = row.geometry
-        if not isinstance(line, LineString): continue
-        n = math.floor(line.length / dist)
-        for i in range(n + 1):
-            pts.append(line.interpolate(i * dist))
-            ids.append(idx)
-    return gpd.GeoDataFrame({"edge_id": ids}, geometry=pts, crs=gdf.crs)
+    lines = gdf[gdf.geom_type == "LineString"]
+    geoms = np.asarray(lines.geometry.array)
+    n = np.floor(shapely.length(geoms) / dist).astype(np.int64) + 1
+    edge_idx = np.repeat(np.arange(len(lines)), n)
+    # position of each point along its own edge: 0, 1, ..., n-1
+    step = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    pts = shapely.line_interpolate_point(geoms[edge_idx], step * dist)
+    return gpd.GeoDataFrame({"edge_id": lines.index.to_numpy()[edge_idx]}, geometry=pts, crs=gdf.crs)
 
 
 def compute_sidepath_presence(ways, pts_gdf, buf_dist):
-    buf = pts_gdf.copy()
-    buf['geometry'] = buf.geometry.buffer(buf_dist)
-    buf = buf.set_geometry('geometry')
-    joined = gpd.sjoin(buf, ways, how="left", predicate="intersects")
-    presence = joined.groupby("edge_id")["index_right"].apply(lambda x: x.notna().any())
-    return presence.to_dict()
+    tree = shapely.STRtree(np.asarray(ways.geometry.array))
+    i_pts, _ = tree.query(np.asarray(pts_gdf.geometry.array), predicate="dwithin", distance=buf_dist)
+    # count intersecting ways per edge_id (inv maps each point to its edge's slot)
+    edge_ids, inv = np.unique(pts_gdf["edge_id"].to_numpy(), return_inverse=True)
+    present = np.zeros(len(edge_ids), dtype=np.int64)
+    np.add.at(present, inv[i_pts], 1)
+    return dict(zip(edge_ids.tolist(), (present > 0).tolist()))
 
 
 def generate_offset_lines(gdf, offset_dist):
-    offs, ids, sides = [], [], []
-    for idx, row in gdf.iterrows():
-        line = row.geometry
-        if not isinstance(line, LineString): continue
-        try:
-            left = line.parallel_offset(offset_dist, 'left', join_style=2)
-            right = line.parallel_offset(offset_dist, 'right', join_style=2)
-        except Exception:
-            continue
-        for geom, side in [(left, 'left'), (right, 'right')]:
-            if isinstance(geom, (LineString, MultiLineString)):
-                offs.append(geom)
-                ids.append(idx)
-                sides.append(side)
-    return gpd.GeoDataFrame({"edge_id": ids, "side": sides}, geometry=offs, crs=gdf.crs)
+    lines = gdf[gdf.geom_type == "LineString"]
+    geoms = np.asarray(lines.geometry.array)
+    parts = []
+    for side, dist in [('left', offset_dist), ('right', -offset_dist)]:
+        parts.append(gpd.GeoDataFrame(
+            {"edge_id": lines.index.to_numpy(), "side": side},
+            geometry=shapely.offset_curve(geoms, dist, join_style="mitre"), crs=gdf.crs))
+    offs = pd.concat(parts, ignore_index=True)
+    return offs[offs.geom_type.isin(["LineString", "MultiLineString"])]
 
 
 def compute_quality_index(df):
@@ -139,25 +137,26 @@ def compute_quality_index(df):
 
 def main():
     args = parse_args()
+    keep = ["highway","cycleway","cycleway:left","cycleway:right",
+            "cycleway:both","cycleway:segregated","bicycle","lanes",
+            "maxspeed","name","surface","lit","oneway"]
+    # read only the attributes used below
+    read = partial(gpd.read_file, engine="pyogrio", columns=keep)
     if os.path.isdir(args.input):
         files = glob.glob(os.path.join(args.input, "*.geojson"))
-        gdfs = [gpd.read_file(f) for f in files]
+        gdfs = [read(f) for f in files]
         ways = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=gdfs[0].crs)
     else:
         if args.layers:
-            gdfs = [gpd.read_file(args.input, layer=l) for l in args.layers]
+            gdfs = [read(args.input, layer=l) for l in args.layers]
             ways = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=gdfs[0].crs)
         else:
-            ways = gpd.read_file(args.input)
+            ways = read(args.input)
 
     ways = ways.to_crs(args.crs_metric)
-    keep = ["highway","cycleway","cycleway:left","cycleway:right",
-            "cycleway:both","cycleway:segregated","bicycle","lanes",
-            "maxspeed","name","surface","lit","oneway"]
     for f in keep:
         ways[f] = ways.get(f)
     ways = ways.rename(columns={c: c.replace(':','_') for c in keep})
-    ways = ways[[c.replace(':','_') for c in keep]+["geometry"]].copy()
 
     ways = remove_deadends(ways)
     ways['length_m'] = ways.geometry.length
@@ -167,20 +166,18 @@ def main():
     side_dict = compute_sidepath_presence(ways, pts, args.buffer_distance)
     ways['sidepath_presence']=ways.index.map(side_dict).fillna(False)
 
-    ways['proc_maxspeed']=ways['maxspeed'].apply(extract_numeric)
-    def has_barrier(r):
-        for v in [r['cycleway'],r['cycleway_left'],r['cycleway_right'],
-                  r['cycleway_both'],r['cycleway_segregated']]:
-            if v and str(v).lower() in ['track','separate','yes']:
-                return True
-        return False
-    ways['has_physical_barrier']=ways.apply(has_barrier,axis=1)
+    ways['proc_maxspeed']=extract_numeric(ways['maxspeed'])
+    barrier=np.zeros(len(ways),dtype=bool)
+    for c in ['cycleway','cycleway_left','cycleway_right',
+              'cycleway_both','cycleway_segregated']:
+        barrier|=ways[c].astype(str).str.lower().isin(['track','separate','yes']).to_numpy()
+    ways['has_physical_barrier']=barrier
     ways=compute_quality_index(ways)
 
     os.makedirs(os.path.dirname(args.output),exist_ok=True)
     ext=os.path.splitext(args.output)[1].lower()
     driver='GeoJSON' if ext in ['.geojson','.json'] else 'GPKG'
-    ways.to_file(args.output,layer='cqi',driver=driver)
+    ways.to_file(args.output,layer='cqi',driver=driver,engine='pyogrio')
     print(f"✅ Done. Output saved to {args.output} using {driver} driver")
 
 if __name__=='__main__':
@@ -0,0 +1,33 @@
+import os
+import pickle
+import hashlib
+import osmnx as ox
+
+# OSMnx 缓存目录：Overpass/Nominatim 的 HTTP 响应和抓好的路网图都放这里
+CACHE_DIR = "./.osmnx_cache"
+
+ox.settings.use_cache = True
+ox.settings.cache_folder = CACHE_DIR
+
+
+def load_or_fetch_london(custom_filter, place_name="Greater London, United Kingdom", simplify=True):
+    """
+    读取本地缓存的伦敦骑行路网；没有缓存时才从 Overpass 下载，并保存一份。
+    缓存文件名由 place_name + custom_filter + simplify 决定，不同过滤器互不覆盖。
+    用 pickle 保存，列表型属性（如多值 highway）原样保留。
+    """
+    key = hashlib.md5(repr((place_name, custom_filter, simplify)).encode("utf-8")).hexdigest()[:12]
+    graph_path = os.path.join(CACHE_DIR, f"london_bike_{key}.pkl")
+
+    if os.path.exists(graph_path):
+        print(f"📦 读取缓存路网：{graph_path}")
+        with open(graph_path, "rb") as f:
+            return pickle.load(f)
+
+    gdf = ox.geocode_to_gdf(place_name)
+    G = ox.graph_from_polygon(gdf.geometry[0], custom_filter=custom_filter, simplify=simplify)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(graph_path, "wb") as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return G
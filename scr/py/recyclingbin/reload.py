@@ -1,7 +1,7 @@
 # QGIS/CPython 通用热重载小工具
 # 用法示例在文件末尾
 
-import importlib, sys, os, time, inspect
+import importlib, sys, os, time, inspect, mmap
 
 def hot_reload(module_name, attrs=None, verify_substring=None, inject_globals=True):
     """
@@ -34,9 +34,13 @@ def hot_reload(module_name, attrs=None, verify_substring=None, inject_globals=Tr
     # 4) 可选：核查源码里是否还包含某个旧字符串（比如旧的 raise 文案）
     if verify_substring:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                src = f.read()
-            hit = verify_substring in src
+            # mmap 直接在文件字节上查找，不把整份源码读成 Python 字符串
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    hit = False  # 空文件不能 mmap
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        hit = mm.find(verify_substring.encode("utf-8")) != -1
             print(f"[hot_reload] CONTAINS '{verify_substring}': {hit}")
         except Exception as e:
             print(f"[hot_reload] verify_substring check failed: {e}")